@@ -1,6 +1,9 @@
 import streamlit as st
+import html
 import os
 import logging
+import logging.handlers
+import sys
 import uuid
 from langchain_core.messages import HumanMessage, AIMessage
 
@@ -9,23 +12,37 @@ from config import Config
 from chatbot.chatbot import Chatbot
 from services.memory_manager import MemoryManager
 
-# NEW: import RAG helpers
-from rag.rag_utils import (
-    get_pdf_txt, get_text_chunks, get_embeddings, get_conversation_chain
-)
-
 # --- Logging ---
 if not os.path.exists(Config.LOG_DIR):
     os.makedirs(Config.LOG_DIR)
 
+# The log file is the record the dashboard reads; it rotates by size and is opened on the first write.
+# Echoing every record to stdout as well is only useful when someone is watching a terminal.
+log_handlers = [logging.handlers.RotatingFileHandler(Config.LOG_FILE, maxBytes=Config.LOG_MAX_BYTES,
+                                                     backupCount=Config.LOG_BACKUP_COUNT, delay=True)]
+if Config.LOG_TO_CONSOLE or sys.stdout.isatty():
+    log_handlers.append(logging.StreamHandler())
+
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s',
-                    handlers=[
-                        logging.FileHandler(Config.LOG_FILE),
-                        logging.StreamHandler()
-                    ])
+                    handlers=log_handlers)
 logger = logging.getLogger(__name__)
 
+# --- Conversation history rendering ---
+# Inline styles mirroring st.info / st.success / st.error, so the whole history can be sent as one element
+HISTORY_MESSAGE_STYLES = {
+    "user": "background-color: rgba(28, 131, 225, 0.1); color: rgb(0, 66, 128);",
+    "ai": "background-color: rgba(33, 195, 84, 0.1); color: rgb(23, 114, 51);",
+    "blocked": "background-color: rgba(255, 43, 43, 0.09); color: rgb(125, 53, 59);",
+}
+BLOCKED_MESSAGE_PREFIXES = ("🚫", "⚠️") # Prefixes of the chatbot's blocked-input and blocked-output messages
+
+def format_history_message(label: str, content: str, kind: str) -> str:
+    """Formats one chat message as an HTML block; content is escaped and kept on a single line."""
+    escaped_content = html.escape(content).replace("\n", "<br>")
+    return (f'<div style="{HISTORY_MESSAGE_STYLES[kind]} padding: 1rem; border-radius: 0.5rem;">'
+            f'<strong>{label}:</strong> {escaped_content}</div>')
+
 # --- Streamlit UI ---
 def main():
     st.set_page_config(page_title="Secure AI Chatbot", layout="wide")
@@ -49,11 +66,12 @@ def main():
 
     pdf_docs = st.sidebar.file_uploader("Upload PDFs:", accept_multiple_files=True)
     if st.sidebar.button("Process PDFs"):
+        # RAG helpers pull in PDF parsing, FAISS and the retrieval chain stack, so they are only
+        # imported once documents are actually processed rather than on every Streamlit rerun.
+        from rag.rag_utils import build_vectorstore, get_conversation_chain
+
         with st.spinner("Processing documents..."):
-            raw_text = get_pdf_txt(pdf_docs)
-            chunks = get_text_chunks(raw_text)
-            embeddings = get_embeddings()
-            vectorstore = FAISS.from_texts(chunks, embeddings)
+            vectorstore = build_vectorstore(tuple(pdf_docs))
             st.session_state.conversation_chain = get_conversation_chain(vectorstore)
             st.sidebar.success("PDFs processed successfully!")
 
@@ -85,16 +103,19 @@ def main():
     if not current_memory_messages:
         st.write("Start chatting to see your conversation history here!")
     else:
-        for i, message in enumerate(reversed(current_memory_messages)):
+        # Build the full history as one HTML blob and render it with a single Streamlit call,
+        # instead of one element (plus a separator) per message
+        parts = []
+        add_part = parts.append # Bound once instead of looked up per message
+        for message in reversed(current_memory_messages): # Iterates in place; no reversed copy of the history
             if isinstance(message, HumanMessage):
-                st.info(f"**You:** {message.content}")
+                add_part(format_history_message("You", message.content, "user"))
             elif isinstance(message, AIMessage):
-                if message.content.startswith("🚫") or message.content.startswith("⚠️"):
-                    st.error(f"**AI:** {message.content}")
-                else:
-                    st.success(f"**AI:** {message.content}")
-            if i < len(current_memory_messages) - 1:
-                st.markdown("---")
+                # Blocked responses are flagged when recorded; the prefix check covers messages stored before the flag existed
+                blocked = message.additional_kwargs.get("blocked") or message.content.startswith(BLOCKED_MESSAGE_PREFIXES)
+                kind = "blocked" if blocked else "ai"
+                add_part(format_history_message("AI", message.content, kind))
+        st.markdown("<hr/>".join(parts), unsafe_allow_html=True)
 
     st.caption("Developed with LangChain and Streamlit")
 
@@ -1,9 +1,11 @@
 # chatbot_moderation_project/chatbot/chatbot.py
+import asyncio
+import concurrent.futures
 import logging
 import streamlit as st
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.messages import HumanMessage, AIMessage # Import these to manually add to memory
 
 from moderation.moderator import ChatbotModerator
@@ -13,6 +15,11 @@ from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Runs main LLM calls off the event loop so they can overlap with input moderation.
+# Kept at module level (not asyncio's default executor) so a blocked turn can return without
+# waiting for a discarded generation to finish.
+_chat_executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="chat-llm")
+
 class Chatbot:
     """
     Main chatbot class, integrating moderation and conversation memory.
@@ -24,84 +31,100 @@ class Chatbot:
             st.error("Main Chat LLM could not be initialized. Please ensure OPENAI_API_KEY is set correctly.")
             st.stop()
 
-        self.moderator = ChatbotModerator()
+        self.moderator = ChatbotModerator.get_instance()
 
         # Define the main chat prompt with a messages placeholder for history
         self.main_chat_prompt = ChatPromptTemplate.from_messages([
             ("system", "You are a helpful and friendly assistant. Respond concisely to the user's query."),
-            MessagesPlaceholder(variable_name="history"), # Matches history_messages_key in RunnableWithMessageHistory
+            MessagesPlaceholder(variable_name="history"), # Populated with the session's messages in get_response
             ("user", "{query}")
         ])
 
-        # Create the core chain (prompt | llm | parser)
-        core_chain = self.main_chat_prompt | self.llm | StrOutputParser()
-
-        # Wrap the core chain with RunnableWithMessageHistory for memory management
-        self.chain_with_history = RunnableWithMessageHistory(
-            core_chain,
-            MemoryManager.get_session_history, # Function to retrieve/create memory per session
-            input_messages_key="query", # Key in the input dict that is the current user query
-            history_messages_key="history" # Key in the prompt template to populate with history
-        )
+        # Create the core chain (prompt | llm | parser).
+        # History is passed in explicitly and only written back once the turn's final response is known,
+        # so blocked or failed generations never need to be removed from memory afterwards.
+        self.chat_chain = self.main_chat_prompt | self.llm | StrOutputParser()
 
     def get_response(self, user_input: str, session_id: str) -> str:
+        """
+        Gets a response from the LLM after moderating the input, integrating LangChain's memory.
+        Synchronous wrapper around get_response_async for Streamlit's script thread.
+        """
+        return asyncio.run(self.get_response_async(user_input, session_id))
+
+    async def get_response_async(self, user_input: str, session_id: str) -> str:
         """
         Gets a response from the LLM after moderating the input, integrating LangChain's memory.
         Also moderates the LLM's generated output and ensures blocked interactions are logged to memory.
+        Each turn is written to memory exactly once: the user's input together with the final response.
         """
         # Get the chat history manager for the current session
         session_history = MemoryManager.get_session_history(session_id)
 
-        # Step 1: Moderate the user's input before sending to the main LLM
-        is_allowed_input, input_moderation_reason = self.moderator.moderate_input(user_input)
-        moderation_response_to_user = ""
+        # Step 1: Moderate the user's input with the local checks (rules, cached verdicts) before anything else
+        input_verdict = self.moderator.moderate_locally(user_input)
+        if input_verdict is not None and not input_verdict[0]:
+            return self._block_input(session_history, user_input, input_verdict[1], session_id)
 
-        if not is_allowed_input:
-            moderation_response_to_user = f"🚫 Your input was blocked: {input_moderation_reason}"
-            logger.info(f"User input was blocked by moderation: {input_moderation_reason} - '{user_input}' (Session: {session_id})")
-            # Manually add the user's input and the moderation response to memory
-            session_history.add_user_message(user_input)
-            session_history.add_ai_message(moderation_response_to_user)
-            return moderation_response_to_user # Return explicit message for user
+        # Step 2: Start the main chatbot chain with the user's query and the session's history so far.
+        # Generation is speculative: it runs while the input's LLM moderation is still in flight, and a
+        # response to an input that ends up blocked is discarded, never shown or stored. It gets a snapshot of the
+        # history, since a blocked turn is recorded (mutating the live list) while the generation may still run.
+        chat_future = _chat_executor.submit(self.chat_chain.invoke, {"query": user_input, "history": list(session_history.messages)})
 
-        logger.info(f"User input accepted; sending to main LLM: '{user_input}' (Session: {session_id})")
+        # Step 3: Finish moderating the input (LLM check) concurrently with generation
+        if input_verdict is None:
+            input_verdict = await self.moderator.moderate_input_async(user_input)
+        if not input_verdict[0]:
+            chat_future.cancel() # Drops the generation if it hasn't started; otherwise its result is ignored
+            return self._block_input(session_history, user_input, input_verdict[1], session_id)
 
-        llm_response = "I'm sorry, I encountered an issue while processing your request. Please try again." # Default error message
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"User input accepted; sending to main LLM: '{user_input}' (Session: {session_id})")
 
+        llm_response = None
         try:
-            # Step 2: Invoke the main chatbot chain with the user's query and session ID.
-            # RunnableWithMessageHistory handles loading/saving history automatically for *successful* turns.
-            llm_response = self.chain_with_history.invoke(
-                {"query": user_input},
-                config={"configurable": {"session_id": session_id}}
-            )
-
-            logger.info(f"Main LLM Raw Response: '{llm_response}' for input: '{user_input}' (Session: {session_id})")
-
-            # Step 3: Moderate the LLM's generated response
-            is_allowed_output, output_moderation_reason = self.moderator.moderate_input(llm_response)
+            llm_response = await asyncio.wrap_future(chat_future)
+            if logger.isEnabledFor(logging.INFO):
+                # The raw response hasn't been moderated yet, so any PII in it is redacted before logging
+                logger.info(f"Main LLM Raw Response: '{self.moderator.redact(llm_response)}' for input: '{user_input}' (Session: {session_id})")
+        except Exception as e:
+            logger.error(f"Error getting response from main LLM for session {session_id}: {e}")
 
+        # Step 4: Moderate the LLM's generated response
+        output_blocked = False
+        if llm_response is None:
+            final_response = "I'm sorry, I encountered an issue while processing your request. Please try again." # Default error message
+        else:
+            is_allowed_output, output_moderation_reason = (await self.moderator.moderate_batch_async([llm_response]))[0]
             if not is_allowed_output:
-                moderation_response_to_user = f"⚠️ My response was blocked due to policy violation: {output_moderation_reason}"
-                logger.warning(f"LLM output blocked by moderation: {output_moderation_reason} - Raw Response: '{llm_response}' (Session: {session_id})")
-                # When LLM output is blocked *after* it's generated, RunnableWithMessageHistory has already added
-                # the user's input and the LLM's raw (potentially harmful) response to memory.
-                # To ensure the UI shows our polite blocked message and that message is also in memory,
-                # we need to remove the last (harmful) AI message and add our custom one.
-                if session_history.messages and isinstance(session_history.messages[-1], AIMessage):
-                    session_history.messages.pop() # Remove the last AI message
-                session_history.add_ai_message(moderation_response_to_user)
-                return moderation_response_to_user
+                final_response = f"⚠️ My response was blocked due to policy violation: {output_moderation_reason}"
+                output_blocked = True
+                logger.warning(f"LLM output blocked by moderation: {output_moderation_reason} - Raw Response: '{self.moderator.redact(llm_response)}' (Session: {session_id})")
             else:
-                logger.info(f"Main LLM Response passed output moderation: '{llm_response}' (Session: {session_id})")
-                return llm_response
-
-        except Exception as e:
-            logger.error(f"Error getting response from main LLM for session {session_id}: {e}")
-            # If main LLM call fails, manually add the user input and error message to memory
-            # The user message would have been added by the chain.invoke call if it was successful up to that point.
-            # We ensure the AI's response is the error message.
-            if session_history.messages and isinstance(session_history.messages[-1], AIMessage):
-                 session_history.messages.pop() # Remove any partial/failed AI response
-            session_history.add_ai_message(llm_response) # Add the error message as AI's response
-            return llm_response
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info(f"Main LLM Response passed output moderation: '{llm_response}' (Session: {session_id})")
+                final_response = llm_response
+
+        # The raw (potentially harmful) LLM output never reaches memory; only the final response does
+        self._record_turn(session_history, user_input, final_response, blocked=output_blocked)
+        return final_response
+
+    def _block_input(self, session_history: BaseChatMessageHistory, user_input: str, reason: str, session_id: str) -> str:
+        """Records a turn whose input was blocked by moderation and returns the message shown to the user."""
+        moderation_response_to_user = f"🚫 Your input was blocked: {reason}"
+        if logger.isEnabledFor(logging.INFO):
+            # Blocked inputs may have been blocked for containing PII, which is kept out of the log file
+            logger.info(f"User input was blocked by moderation: {reason} - '{self.moderator.redact(user_input)}' (Session: {session_id})")
+        # Record the user's input and the moderation response in memory
+        self._record_turn(session_history, user_input, moderation_response_to_user, blocked=True)
+        return moderation_response_to_user # Return explicit message for user
+
+    @staticmethod
+    def _record_turn(session_history: BaseChatMessageHistory, user_input: str, ai_response: str, blocked: bool = False) -> None:
+        """
+        Appends a user message and the AI's response to memory in a single write.
+        Responses replacing a blocked input or output are flagged with additional_kwargs["blocked"].
+        """
+        ai_message = AIMessage(content=ai_response, additional_kwargs={"blocked": True}) if blocked else AIMessage(content=ai_response)
+        session_history.add_messages([HumanMessage(content=user_input), ai_message])
@@ -14,30 +14,85 @@ class Config:
     LLM_MODEL_NAME = "gpt-4o-mini"
     LLM_TEMPERATURE_CHATBOT = 0.7   # Higher temperature for more creative/diverse chatbot responses
     LLM_TEMPERATURE_MODERATION = 0.1 # Lower temperature for more predictable/deterministic moderation responses
+    LLM_TIMEOUT = 30 # Seconds before an OpenAI request times out
+    LLM_MAX_CONNECTIONS = 64 # Size of the shared HTTP connection pool used for all OpenAI requests
+    LLM_MAX_KEEPALIVE_CONNECTIONS = 32 # Idle connections kept open for reuse
+    MODERATION_MAX_TOKENS = 16 # Moderation replies are "SAFE" or "BLOCKED: [Reason]"; generation stops after this many tokens
 
     # Logging settings
     LOG_DIR = "logs"  # Directory where log files will be stored
     LOG_FILE = os.path.join(LOG_DIR, "moderation.log") # Name of the main log file
+    LOG_MAX_BYTES = 10 * 1024 * 1024 # Size at which the log file is rotated
+    LOG_BACKUP_COUNT = 5 # Number of rotated log files kept alongside the current one
+    LOG_TO_CONSOLE = os.getenv("LOG_TO_CONSOLE", "false").lower() == "true" # Also log to stdout when no terminal is attached
+    LOG_STATS_FILE = os.path.join(LOG_DIR, "moderation_stats.json") # Dashboard's incremental parsing checkpoint
+    DASHBOARD_RECENT_LOG_LINES = 500 # Number of most recent log lines shown in the dashboard's raw log viewer
 
     # Moderation policies and patterns
     # These are rule-based checks for efficiency and immediate blocking of obvious violations.
-    MODERATION_KEYWORDS_HATE_SPEECH = [
+    # Keyword and phrase sets are stored lowercased, so matching only has to lowercase the input.
+    MODERATION_KEYWORDS_HATE_SPEECH = frozenset(keyword.lower() for keyword in (
         "hate", "kill", "harm", "attack", "racist", "sexist", "violent",
         "nazi", "terrorist", "bomb", "explode", "genocide", "destroy", "murder", "weapon"
-    ]
-    MODERATION_KEYWORDS_PII = [
-        r"\b\d{3}[-.\s]?\d{3}[-.\s]?\d{4}\b",  # Common US Phone numbers (e.g., 123-456-7890, 123.456.7890)
-        r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}" # Email addresses
-    ]
+    ))
+    # PII patterns by type; they are combined into one alternation regex with a named group per type.
+    # Possessive quantifiers (`?+`, `++`) mark repeats that can never usefully give characters back, and the
+    # email pattern only starts at the beginning of a run of address characters, so long near-miss inputs
+    # are scanned in linear time instead of being retried from every position.
+    MODERATION_KEYWORDS_PII = {
+        "phone": r"(?:\(\d{3}\)\s?+|\b\d{3}[-.\s]?+)\d{3}[-.\s]?+\d{4}\b",  # Common US Phone numbers (e.g., 123-456-7890, 123.456.7890, (987) 654-3210)
+        "email": r"(?<![a-zA-Z0-9._%+-])[a-zA-Z0-9._%+-]++@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\b", # Email addresses
+        "ssn": r"\b\d{3}-\d{2}-\d{4}\b" # US Social Security numbers (e.g., 123-45-6789)
+    }
     # More comprehensive list of jailbreak phrases to enhance rule-based detection
-    MODERATION_JAILBREAK_PHRASES = [
+    MODERATION_JAILBREAK_PHRASES = frozenset(phrase.lower() for phrase in (
         "ignore previous instructions", "act as if", "override your programming",
         "pretend you are", "hypothetically", "new roleplay", "forbidden knowledge",
         "as a large language model", "developer mode", "do anything now",
         "disregard all prior instructions", "you are no longer an AI",
         "simulate being human", "forget everything you know", "act like a different AI",
         "jailbreak", "unleash your full potential", "execute the following code"
-    ]
+    ))
+
+    # Conversation memory settings
+    # Each session keeps its first MEMORY_SINK_MESSAGES messages (the opening context) and its most recent
+    # MEMORY_WINDOW_MESSAGES; older messages in between are dropped, so per-session memory stays bounded.
+    # Turns are stored as (user, AI) pairs, so both values should be even.
+    MEMORY_SINK_MESSAGES = 2    # The first exchange
+    MEMORY_WINDOW_MESSAGES = 20 # The last 10 exchanges
+    # Optionally, full conversations are also written to SESSION_HISTORY_DIR (one JSONL file per session) in the
+    # background, so only the window above stays in memory. Off by default: set PERSIST_CHAT_HISTORY=true to enable.
+    # PII in user messages is redacted before it is written. A file is only read back when a session with the same ID
+    # starts again; app.py generates a new ID for every browser session, so resuming needs a stable session ID.
+    PERSIST_CHAT_HISTORY = os.getenv("PERSIST_CHAT_HISTORY", "false").lower() == "true"
+    SESSION_HISTORY_DIR = os.path.join("data", "sessions")
+    SESSION_FLUSH_INTERVAL_SECONDS = 5 # How often queued history records are written to disk
+    SESSION_HISTORY_RETENTION_DAYS = 30 # History files not written to for this long are deleted
+
+    # LLM moderation call settings
+    # Concurrent sessions' LLM moderation calls are coalesced into a single batched dispatch,
+    # and verdicts for previously seen inputs are served from an in-process LRU cache with a TTL.
+    MODERATION_BATCH_MAX_SIZE = 32    # Dispatch as soon as this many moderation requests are queued
+    MODERATION_BATCH_MAX_WAIT_MS = 5  # Maximum time the first queued request waits for others to join
+    MODERATION_CACHE_MAX_ENTRIES = 10000 # LRU bound for cached LLM moderation verdicts
+    MODERATION_CACHE_TTL_SECONDS = 24 * 60 * 60 # Cached verdicts are re-checked by the LLM after this long
+    # Chat responses are only cached when LLM_TEMPERATURE_CHATBOT is 0, i.e. when replies are deterministic
+    CHAT_CACHE_MAX_ENTRIES = 4096
+    CHAT_CACHE_TTL_SECONDS = 60 * 60
+
+    # Local moderation classifier (optional; requires `transformers` and `torch`)
+    # When enabled, inputs that pass the rule-based checks are classified locally first, and only inputs the
+    # classifier is unsure about go to the moderation LLM, removing the network round-trip for clear-cut ones.
+    # Falls back to the LLM if the model can't be loaded.
+    USE_LOCAL_MODERATION = os.getenv("USE_LOCAL_MODERATION", "false").lower() == "true"
+    LOCAL_MODERATION_MODEL_NAME = "unitary/toxic-bert"
+    LOCAL_MODERATION_SAFE_THRESHOLD = 0.2  # Pass without the LLM when every toxicity label scores below this probability
+    LOCAL_MODERATION_BLOCK_THRESHOLD = 0.8 # Block without the LLM when any toxicity label scores at or above this probability
+    # Run the classifier with ONNX Runtime on CPU (requires `optimum[onnxruntime]`); the model is exported on first load
+    LOCAL_MODERATION_USE_ONNX = os.getenv("LOCAL_MODERATION_USE_ONNX", "false").lower() == "true"
+    LOCAL_MODERATION_ONNX_DIR = os.path.join("models", "local_moderation") # Where the exported ONNX model is kept
+    # Quantize the classifier's weights to INT8 (ONNX Runtime dynamic quantization, or PyTorch's without ONNX)
+    LOCAL_MODERATION_QUANTIZE = os.getenv("LOCAL_MODERATION_QUANTIZE", "false").lower() == "true"
 
     # Future Configuration Ideas (for your README's "Future Enhancements" section):
     # - DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db") # For persistent memory
@@ -1,20 +1,39 @@
 import streamlit as st
 import os
 import re
-import pandas as pd
-import plotly.express as px
+import json
 from config import Config # Import Config to get log file path
 
 # --- Dashboard Configuration ---
 # User will manually refresh the dashboard.
 
 # --- Log Parsing Logic ---
-def parse_moderation_log(log_file_path: str) -> dict:
-    """
-    Parses the moderation log file and extracts relevant metrics, including detailed block types.
-    This version uses more robust regex patterns to accurately categorize all interaction types.
-    """
-    log_data = {
+# Each line is classified with a single alternation; the matching named group is the interaction type.
+LOG_EVENT_PATTERN = re.compile(
+    r"(?P<input_accepted>INFO - User input accepted; sending to main LLM:)"
+    r"|(?P<input_blocked>WARNING - User input was blocked by moderation:)"
+    r"|(?P<input_blocked_rule_legacy>WARNING - User input blocked \(Rule-based\):)" # Older log format
+    r"|(?P<input_blocked_llm_legacy>WARNING - User input blocked by LLM moderation:)" # Older log format
+    r"|(?P<input_blocked_local>WARNING - User input blocked by local moderation:)" # Local classifier blocks
+    r"|(?P<output_accepted>INFO - Main LLM Response passed output moderation:)"
+    r"|(?P<output_blocked>WARNING - LLM output blocked by moderation:)"
+)
+# Block reasons for input blocks; group names are the counters they increment
+BLOCK_REASON_PATTERN = re.compile(
+    r"(?P<user_input_blocked_hate_speech>Hate speech detected)"
+    r"|(?P<user_input_blocked_pii>Personal identifiable information detected)"
+    r"|(?P<user_input_blocked_jailbreak>Jailbreak attempt detected)"
+    r"|(?P<user_input_blocked_llm_general>User input blocked \(LLM-based\):)" # LLM-based input blocks
+)
+LEGACY_BLOCK_REASON_PATTERN = re.compile(
+    r"(?P<user_input_blocked_hate_speech>Hate speech detected)"
+    r"|(?P<user_input_blocked_pii>PII detected)"
+    r"|(?P<user_input_blocked_jailbreak>Jailbreak attempt detected)"
+)
+
+def _empty_log_counts() -> dict:
+    return {
+        "total_log_lines": 0,               # Total lines parsed from the log so far
         "total_user_inputs": 0,             # Total distinct user inputs attempted
         "user_input_accepted": 0,
         "user_input_blocked_overall": 0,    # Sum of all blocked inputs (rules + LLM general)
@@ -26,110 +45,160 @@ def parse_moderation_log(log_file_path: str) -> dict:
         "total_llm_generations": 0,         # Total times LLM was asked to generate a response (i.e., user input was accepted)
         "llm_output_accepted": 0,
         "llm_output_blocked": 0,            # LLM's own output was blocked by moderation ("wrong replies")
-
-        "all_log_lines": []                 # Stores all log lines for raw display
     }
 
+def _count_log_lines(lines: list[str], counts: dict) -> None:
+    """
+    Classifies a batch of log lines and adds them to the running counters in place.
+    Matching runs as vectorized pandas string operations rather than a Python-level loop per line:
+    each named group of LOG_EVENT_PATTERN becomes a boolean column marking the lines of that type.
+    """
+    if not lines:
+        return
+    import pandas as pd # Imported lazily; see main()
+    log_lines = pd.Series(lines, dtype=object)
+    events = log_lines.str.extract(LOG_EVENT_PATTERN).notna()
+    event_counts = events.sum()
+
+    # --- User Input Processing ---
+    accepted = int(event_counts["input_accepted"])
+    counts["total_user_inputs"] += accepted
+    counts["user_input_accepted"] += accepted
+    counts["total_llm_generations"] += accepted # LLM only generates if input is accepted
+
+    blocked = int(event_counts[["input_blocked", "input_blocked_rule_legacy", "input_blocked_llm_legacy", "input_blocked_local"]].sum())
+    counts["total_user_inputs"] += blocked
+    counts["user_input_blocked_overall"] += blocked
+    # The local classifier stands in for the moderation LLM, so its blocks count as LLM general blocks
+    counts["user_input_blocked_llm_general"] += int(event_counts[["input_blocked_llm_legacy", "input_blocked_local"]].sum())
+    for event, reason_pattern in (("input_blocked", BLOCK_REASON_PATTERN),
+                                  ("input_blocked_rule_legacy", LEGACY_BLOCK_REASON_PATTERN)):
+        blocked_lines = log_lines[events[event]]
+        if not blocked_lines.empty:
+            for reason, count in blocked_lines.str.extract(reason_pattern).notna().sum().items():
+                counts[reason] += int(count)
+
+    # --- LLM Output Processing ---
+    counts["llm_output_accepted"] += int(event_counts["output_accepted"])
+    counts["llm_output_blocked"] += int(event_counts["output_blocked"])
+
+def _load_log_state(log_file_path: str) -> None:
+    """
+    Ensures parsing progress is present in st.session_state.
+    A new session resumes from the sidecar stats file so earlier log lines are not parsed again.
+    """
+    if st.session_state.get("log_file") == log_file_path:
+        return
+    state = {"log_file": log_file_path, "log_offset": 0, "log_inode": None,
+             "log_counts": _empty_log_counts(), "log_recent_lines": []}
+    try:
+        if os.path.exists(Config.LOG_STATS_FILE):
+            with open(Config.LOG_STATS_FILE, "r") as f:
+                saved_state = json.load(f)
+            if saved_state.get("log_file") == log_file_path:
+                state.update(saved_state)
+    except (OSError, ValueError) as e:
+        st.warning(f"Could not load saved log statistics ({e}). Re-parsing the full log.")
+    st.session_state.update(state)
+
+def _save_log_state() -> None:
+    """Writes parsing progress to the sidecar stats file (atomically) so it survives a full restart."""
+    state = {key: st.session_state[key] for key in ("log_file", "log_offset", "log_inode", "log_counts", "log_recent_lines")}
+    tmp_path = Config.LOG_STATS_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, Config.LOG_STATS_FILE)
+
+def _read_complete_lines(path: str, offset: int) -> tuple[list[str], int]:
+    """
+    Reads the complete lines after the byte offset.
+    Returns them along with the offset just past the last one; a partially written last line is left for the next read.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        new_data = f.read()
+    end = new_data.rfind(b"\n") + 1
+    lines = [line.strip() for line in new_data[:end].decode("utf-8", errors="replace").splitlines()]
+    return lines, offset + end
+
+def _read_rotated_tail(log_file_path: str, inode: int, offset: int) -> list[str]:
+    """
+    Returns the lines still unread after the log was rotated: the rest of the file previously being read
+    (now a numbered backup, found by its inode) followed by every backup rotated out after it, oldest first.
+    Returns nothing if that file has already been deleted by the rotation.
+    """
+    lines = []
+    found = False
+    for i in range(Config.LOG_BACKUP_COUNT, 0, -1): # Highest-numbered backup is the oldest
+        backup_path = f"{log_file_path}.{i}"
+        try:
+            backup_inode = os.stat(backup_path).st_ino
+        except FileNotFoundError:
+            continue
+        if found:
+            lines.extend(_read_complete_lines(backup_path, 0)[0])
+        elif backup_inode == inode:
+            found = True
+            lines.extend(_read_complete_lines(backup_path, offset)[0])
+    return lines
+
+def parse_moderation_log(log_file_path: str) -> dict:
+    """
+    Parses the moderation log file and extracts relevant metrics, including detailed block types.
+    Parsing is incremental: the byte offset reached so far is checkpointed along with the file's inode,
+    so each refresh only reads and classifies lines appended since the previous one. When the inode
+    changes the log was rotated; the unread rest of the rotated file is drained before the new one is read.
+    """
+    _load_log_state(log_file_path)
+    counts = st.session_state.log_counts
+
     try:
         if not os.path.exists(log_file_path):
             st.warning(f"Log file not found at: {log_file_path}. No data to display.")
-            return log_data # Return empty if file not found
-
-        with open(log_file_path, "r") as f:
-            for line in f:
-                log_data["all_log_lines"].append(line.strip())
-
-                # --- User Input Processing ---
-                # Pattern for user input accepted
-                if re.search(r"INFO - User input accepted; sending to main LLM:", line):
-                    log_data["total_user_inputs"] += 1
-                    log_data["user_input_accepted"] += 1
-                    log_data["total_llm_generations"] += 1 # LLM only generates if input is accepted
-                # Pattern for user input blocked (rule-based or LLM-based)
-                elif re.search(r"WARNING - User input was blocked by moderation:", line):
-                    log_data["total_user_inputs"] += 1
-                    log_data["user_input_blocked_overall"] += 1
-
-                    if "Hate speech detected" in line:
-                        log_data["user_input_blocked_hate_speech"] += 1
-                    elif "Personal identifiable information detected" in line:
-                        log_data["user_input_blocked_pii"] += 1
-                    elif "Jailbreak attempt detected" in line:
-                        log_data["user_input_blocked_jailbreak"] += 1
-                    # This captures LLM-based input blocks that are not specific rule types
-                    elif re.search(r"User input blocked \(LLM-based\):", line):
-                        log_data["user_input_blocked_llm_general"] += 1
-                # Fallback for older log formats (if any are still present)
-                elif re.search(r"WARNING - User input blocked \(Rule-based\):", line):
-                    log_data["total_user_inputs"] += 1
-                    log_data["user_input_blocked_overall"] += 1
-                    if "Hate speech detected" in line:
-                        log_data["user_input_blocked_hate_speech"] += 1
-                    elif "PII detected" in line:
-                        log_data["user_input_blocked_pii"] += 1
-                    elif "Jailbreak attempt detected" in line:
-                        log_data["user_input_blocked_jailbreak"] += 1
-                elif re.search(r"WARNING - User input blocked by LLM moderation:", line):
-                    log_data["total_user_inputs"] += 1
-                    log_data["user_input_blocked_overall"] += 1
-                    log_data["user_input_blocked_llm_general"] += 1
-
-
-                # --- LLM Output Processing ---
-                # Pattern for LLM output accepted
-                if re.search(r"INFO - Main LLM Response passed output moderation:", line):
-                    log_data["llm_output_accepted"] += 1
-                # Pattern for LLM output blocked
-                elif re.search(r"WARNING - LLM output blocked by moderation:", line):
-                    log_data["llm_output_blocked"] += 1
+        else:
+            offset = st.session_state.log_offset
+            inode = st.session_state.log_inode
+            current_inode = os.stat(log_file_path).st_ino
+            new_lines = []
+            if inode is not None and current_inode != inode:
+                new_lines = _read_rotated_tail(log_file_path, inode, offset)
+                offset = 0
+            elif os.path.getsize(log_file_path) < offset:
+                offset = 0 # Log was truncated in place; keep the counters and read it from the start
+
+            lines, new_offset = _read_complete_lines(log_file_path, offset)
+            new_lines.extend(lines)
+            if new_lines:
+                _count_log_lines(new_lines, counts)
+                counts["total_log_lines"] += len(new_lines)
+                st.session_state.log_recent_lines = (st.session_state.log_recent_lines + new_lines)[-Config.DASHBOARD_RECENT_LOG_LINES:]
+            if new_lines or new_offset != st.session_state.log_offset or current_inode != inode:
+                st.session_state.log_offset = new_offset
+                st.session_state.log_inode = current_inode
+                _save_log_state()
 
     except Exception as e:
         st.error(f"Error parsing log file: {e}. Please ensure the log file is accessible and not corrupted.")
-    return log_data
-
-# --- Streamlit UI for Dashboard ---
-def main():
-    st.set_page_config(page_title="Chatbot Moderation Dashboard", layout="wide")
-    st.title("📊 Chatbot Moderation Analytics Dashboard")
-    st.markdown("""
-        This dashboard provides insights into user interactions and LLM moderation effectiveness.
-        It's designed for administrators and privacy-conscious monitoring.
-    """)
-    st.markdown("---")
 
-    # Manual Refresh Button
-    if st.button("Refresh Dashboard Data", key="refresh_dashboard_button", use_container_width=True):
-        st.experimental_rerun() # Forces a full rerun of the script to refresh data
-
-    st.empty().write(f"Last updated: {pd.to_datetime('now').strftime('%Y-%m-%d %H:%M:%S')}")
+    return {**counts, "recent_log_lines": st.session_state.log_recent_lines}
 
+# --- Charts ---
+# Counters plotted by the charts; the figure cache is keyed on their values
+CHART_COUNT_KEYS = (
+    "user_input_accepted", "user_input_blocked_hate_speech", "user_input_blocked_pii",
+    "user_input_blocked_jailbreak", "user_input_blocked_llm_general",
+    "llm_output_accepted", "llm_output_blocked",
+)
 
-    # Parse logs
-    logs_data = parse_moderation_log(Config.LOG_FILE)
-
-    # --- Metrics Cards ---
-    st.header("Key Metrics")
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric(label="Total User Inputs (Attempted)", value=logs_data["total_user_inputs"])
-    with col2:
-        st.metric(label="Total LLM Generations (Attempted)", value=logs_data["total_llm_generations"])
-    with col3:
-        st.metric(label="Overall Input Block Rate",
-                  value=f"{((logs_data['user_input_blocked_overall'] / logs_data['total_user_inputs']) * 100):.1f}%" if logs_data['total_user_inputs'] > 0 else "0.0%")
-
-    col4, col5, col6 = st.columns(3)
-    with col4:
-        st.metric(label="User Inputs Accepted", value=logs_data["user_input_accepted"])
-    with col5:
-        st.metric(label="User Inputs Blocked", value=logs_data["user_input_blocked_overall"])
-    with col6:
-        st.metric(label="LLM Outputs Blocked (Wrong Replies)", value=logs_data["llm_output_blocked"])
-
-    st.markdown("---")
-
-    # --- User Input Moderation Breakdown (Graph) ---
-    st.header("User Input Moderation Breakdown")
+@st.cache_data(max_entries=32, show_spinner=False)
+def build_figures(chart_counts: tuple) -> tuple:
+    """
+    Builds the input overview pie chart and the blocked-input and LLM-output bar charts.
+    A figure is None when all of its counts are 0.
+    """
+    import pandas as pd # Imported lazily; see main()
+    import plotly.express as px
+    logs_data = dict(chart_counts)
 
     # Always include all categories, even if counts are 0, for comprehensive display
     input_overview_data = {
@@ -142,9 +211,8 @@ def main():
             logs_data["user_input_blocked_llm_general"]
         ]
     }
-
     input_overview_df = pd.DataFrame(input_overview_data)
-    # Only plot if there's any data at all
+    fig_input_overview = None
     if input_overview_df["Count"].sum() > 0:
         fig_input_overview = px.pie(input_overview_df, values="Count", names="Category",
                                     title="Overall User Input Moderation Status",
@@ -156,13 +224,7 @@ def main():
                                         "Jailbreak Block": "purple",
                                         "LLM General Block": "brown"
                                     })
-        st.plotly_chart(fig_input_overview, use_container_width=True)
-    else:
-        st.info("No user input data to display in the pie chart yet.")
-
 
-    # Detailed bar chart for BLOCKED User Inputs
-    st.subheader("Breakdown of Blocked User Inputs")
     blocked_input_data = {
         "Block Type": ["Hate Speech", "PII", "Jailbreak", "LLM General"],
         "Count": [
@@ -173,7 +235,7 @@ def main():
         ]
     }
     blocked_input_df = pd.DataFrame(blocked_input_data)
-
+    fig_blocked_inputs = None
     if blocked_input_df["Count"].sum() > 0:
         fig_blocked_inputs = px.bar(blocked_input_df, x="Block Type", y="Count",
                                     title="Blocked User Inputs by Type",
@@ -185,15 +247,7 @@ def main():
                                          "LLM General": "brown"
                                     },
                                     text="Count") # Display count on bars
-        st.plotly_chart(fig_blocked_inputs, use_container_width=True)
-    else:
-        st.info("No blocked user input data to display in the bar chart yet.")
-
-
-    st.markdown("---")
 
-    # --- LLM Output Moderation Breakdown (Graph) ---
-    st.header("LLM Output Moderation Breakdown")
     llm_output_data = {
         "Category": ["Accepted", "Blocked (Wrong Reply)"],
         "Count": [
@@ -202,7 +256,7 @@ def main():
         ]
     }
     llm_output_df = pd.DataFrame(llm_output_data)
-
+    fig_llm_output = None
     if llm_output_df["Count"].sum() > 0:
         # Set custom colors for accepted/blocked
         color_map_llm_output = {"Accepted": "green", "Blocked (Wrong Reply)": "red"}
@@ -211,6 +265,81 @@ def main():
                                  color="Category",
                                  color_discrete_map=color_map_llm_output,
                                  text="Count") # Display count on bars
+
+    return fig_input_overview, fig_blocked_inputs, fig_llm_output
+
+# --- Streamlit UI for Dashboard ---
+def main():
+    st.set_page_config(page_title="Chatbot Moderation Dashboard", layout="wide")
+    st.title("📊 Chatbot Moderation Analytics Dashboard")
+    st.markdown("""
+        This dashboard provides insights into user interactions and LLM moderation effectiveness.
+        It's designed for administrators and privacy-conscious monitoring.
+    """)
+    st.markdown("---")
+
+    # Manual Refresh Button
+    if st.button("Refresh Dashboard Data", key="refresh_dashboard_button", use_container_width=True):
+        st.experimental_rerun() # Forces a full rerun of the script to refresh data
+
+    # Heavy data libraries are imported here (plotly in build_figures) rather than at module level,
+    # so a refresh click (which reruns the script straight away) does not wait on them.
+    import pandas as pd
+
+    st.empty().write(f"Last updated: {pd.to_datetime('now').strftime('%Y-%m-%d %H:%M:%S')}")
+
+
+    # Parse logs
+    logs_data = parse_moderation_log(Config.LOG_FILE)
+
+    # --- Metrics Cards ---
+    st.header("Key Metrics")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric(label="Total User Inputs (Attempted)", value=logs_data["total_user_inputs"])
+    with col2:
+        st.metric(label="Total LLM Generations (Attempted)", value=logs_data["total_llm_generations"])
+    with col3:
+        st.metric(label="Overall Input Block Rate",
+                  value=f"{((logs_data['user_input_blocked_overall'] / logs_data['total_user_inputs']) * 100):.1f}%" if logs_data['total_user_inputs'] > 0 else "0.0%")
+
+    col4, col5, col6 = st.columns(3)
+    with col4:
+        st.metric(label="User Inputs Accepted", value=logs_data["user_input_accepted"])
+    with col5:
+        st.metric(label="User Inputs Blocked", value=logs_data["user_input_blocked_overall"])
+    with col6:
+        st.metric(label="LLM Outputs Blocked (Wrong Replies)", value=logs_data["llm_output_blocked"])
+
+    st.markdown("---")
+
+    # --- User Input Moderation Breakdown (Graph) ---
+    st.header("User Input Moderation Breakdown")
+
+    # Figures are rebuilt only when the counts they plot have changed
+    chart_counts = tuple(sorted((key, logs_data[key]) for key in CHART_COUNT_KEYS))
+    fig_input_overview, fig_blocked_inputs, fig_llm_output = build_figures(chart_counts)
+
+    # Only plot if there's any data at all
+    if fig_input_overview is not None:
+        st.plotly_chart(fig_input_overview, use_container_width=True)
+    else:
+        st.info("No user input data to display in the pie chart yet.")
+
+
+    # Detailed bar chart for BLOCKED User Inputs
+    st.subheader("Breakdown of Blocked User Inputs")
+    if fig_blocked_inputs is not None:
+        st.plotly_chart(fig_blocked_inputs, use_container_width=True)
+    else:
+        st.info("No blocked user input data to display in the bar chart yet.")
+
+
+    st.markdown("---")
+
+    # --- LLM Output Moderation Breakdown (Graph) ---
+    st.header("LLM Output Moderation Breakdown")
+    if fig_llm_output is not None:
         st.plotly_chart(fig_llm_output, use_container_width=True)
     else:
         st.info("No LLM output data to display in the chart yet.")
@@ -220,8 +349,8 @@ def main():
 
     # --- Raw Logs Viewer ---
     st.header("Raw Activity Logs")
-    st.write(f"Displaying all {len(logs_data['all_log_lines'])} entries from `{Config.LOG_FILE}`.")
-    st.code("\n".join(logs_data["all_log_lines"]), language="log") # REMOVED height argument
+    st.write(f"Displaying the last {len(logs_data['recent_log_lines'])} of {logs_data['total_log_lines']} entries from `{Config.LOG_FILE}`.")
+    st.code("\n".join(logs_data["recent_log_lines"]), language="log") # REMOVED height argument
 
     st.markdown("---")
     st.caption("Dashboard powered by Streamlit and Plotly")
@@ -0,0 +1,13 @@
+import re
+from config import Config # Import Config to access the PII patterns
+
+# Kept free of the moderation chain's dependencies (LangChain, the LLM service), so modules that only
+# need to keep PII out of logs or files can import it cheaply.
+
+# All PII patterns as one alternation, compiled once at import so the input is searched in a single pass;
+# the named group identifies the type
+PII_RE = re.compile("|".join(f"(?P<{pii_type}>{pattern})" for pii_type, pattern in Config.MODERATION_KEYWORDS_PII.items()))
+
+def redact(text: str) -> str:
+    """Replaces every PII match with a placeholder naming its type, e.g. "[REDACTED EMAIL]"."""
+    return PII_RE.sub(lambda match: f"[REDACTED {match.lastgroup.upper()}]", text)
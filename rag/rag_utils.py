@@ -1,11 +1,24 @@
+import hashlib
+import io
+import faiss
+import numpy as np
+import streamlit as st
+from streamlit.runtime.uploaded_file_manager import UploadedFile
 from PyPDF2 import PdfReader
 from langchain.text_splitter import CharacterTextSplitter
 from langchain_community.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain.chat_models import ChatOpenAI
 from langchain.chains import ConversationalRetrievalChain
 from langchain.memory import ConversationBufferMemory
 
+# Indexes with at least this many chunks use an IVF index (approximate search over IVF_NLIST clusters,
+# IVF_NPROBE of which are searched per query); smaller ones stay exact. FAISS needs ~39 training points per cluster.
+IVF_NLIST = 100
+IVF_NPROBE = 10
+IVF_MIN_CHUNKS = 39 * IVF_NLIST
+
 def get_pdf_txt(pdf_docs):
     text = ""
     for pdf in pdf_docs:
@@ -20,9 +33,35 @@ def get_text_chunks(text):
     )
     return splitter.split_text(text)
 
+@st.cache_resource # Build the embedding model once per process instead of on every upload
 def get_embeddings():
     return OpenAIEmbeddings()
 
+# Each file is embedded once per distinct content, so processing the same uploads plus a new file
+# only sends the new file's chunks to the embedding API
+@st.cache_data(max_entries=256, show_spinner=False)
+def embed_pdf(pdf_bytes: bytes) -> list[tuple[str, list[float]]]:
+    chunks = get_text_chunks(get_pdf_txt([io.BytesIO(pdf_bytes)]))
+    return list(zip(chunks, get_embeddings().embed_documents(chunks)))
+
+# Uploads are keyed by content, so re-uploading identical PDFs reuses the already-built index.
+# The cache is shared by every session and each entry is a whole index, so it is bounded by count and age;
+# an evicted index is rebuilt from the cached embeddings, without calling the embedding API again.
+@st.cache_resource(max_entries=8, ttl=60 * 60,
+                   hash_funcs={UploadedFile: lambda f: hashlib.sha256(f.getvalue()).hexdigest()})
+def build_vectorstore(pdf_docs: tuple):
+    text_embeddings = [pair for pdf in pdf_docs for pair in embed_pdf(pdf.getvalue())]
+    if len(text_embeddings) < IVF_MIN_CHUNKS:
+        return FAISS.from_embeddings(text_embeddings, get_embeddings())
+
+    vectors = np.array([vector for _, vector in text_embeddings], dtype=np.float32)
+    index = faiss.IndexIVFFlat(faiss.IndexFlatL2(vectors.shape[1]), vectors.shape[1], IVF_NLIST)
+    index.train(vectors)
+    index.nprobe = IVF_NPROBE
+    vectorstore = FAISS(get_embeddings(), index, InMemoryDocstore(), {})
+    vectorstore.add_embeddings(text_embeddings)
+    return vectorstore
+
 def get_conversation_chain(vectorstore):
     llm = ChatOpenAI(model_name="gpt-4.1-nano")
     memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
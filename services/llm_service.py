@@ -1,35 +1,128 @@
+import atexit
 import logging
-from langchain_openai import ChatOpenAI
+import os
+import threading
+from typing import TYPE_CHECKING
+import httpx
 from config import Config # Import Config to access LLM settings and API key
 
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
 logger = logging.getLogger(__name__)
 
+# One connection pool per process for all OpenAI calls, so TLS sessions are reused and HTTP/2 lets
+# concurrent requests share connections. The sync client serves the chat path, the async one the
+# moderation batcher's event loop.
+_HTTP_LIMITS = httpx.Limits(max_connections=Config.LLM_MAX_CONNECTIONS,
+                            max_keepalive_connections=Config.LLM_MAX_KEEPALIVE_CONNECTIONS)
+_HTTP_CLIENT = httpx.Client(http2=True, limits=_HTTP_LIMITS, timeout=Config.LLM_TIMEOUT)
+_ASYNC_HTTP_CLIENT = httpx.AsyncClient(http2=True, limits=_HTTP_LIMITS, timeout=Config.LLM_TIMEOUT)
+atexit.register(_HTTP_CLIENT.close)
+
+def _load_local_moderation_classifier():
+    """
+    Builds the local moderation text-classification pipeline (requires `transformers`).
+    With Config.LOCAL_MODERATION_USE_ONNX the model runs on ONNX Runtime (requires `optimum[onnxruntime]`);
+    with Config.LOCAL_MODERATION_QUANTIZE its weights are quantized to INT8 for faster CPU inference.
+    Exported/quantized ONNX models are saved to Config.LOCAL_MODERATION_ONNX_DIR and reused on later starts.
+    """
+    from transformers import AutoTokenizer, pipeline # Optional dependency, only needed for local moderation
+
+    if Config.LOCAL_MODERATION_USE_ONNX:
+        from optimum.onnxruntime import ORTModelForSequenceClassification # Optional dependency
+        model_file = "model_quantized.onnx" if Config.LOCAL_MODERATION_QUANTIZE else "model.onnx"
+        if not os.path.exists(os.path.join(Config.LOCAL_MODERATION_ONNX_DIR, model_file)):
+            ort_model = ORTModelForSequenceClassification.from_pretrained(Config.LOCAL_MODERATION_MODEL_NAME, export=True)
+            ort_model.save_pretrained(Config.LOCAL_MODERATION_ONNX_DIR)
+            AutoTokenizer.from_pretrained(Config.LOCAL_MODERATION_MODEL_NAME).save_pretrained(Config.LOCAL_MODERATION_ONNX_DIR)
+            if Config.LOCAL_MODERATION_QUANTIZE:
+                from optimum.onnxruntime import ORTQuantizer
+                from optimum.onnxruntime.configuration import AutoQuantizationConfig
+                # Dynamic quantization: weights stored as INT8, activations quantized on the fly
+                quantization_config = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+                ORTQuantizer.from_pretrained(ort_model).quantize(save_dir=Config.LOCAL_MODERATION_ONNX_DIR,
+                                                                 quantization_config=quantization_config)
+        model = ORTModelForSequenceClassification.from_pretrained(Config.LOCAL_MODERATION_ONNX_DIR, file_name=model_file,
+                                                                  provider="CPUExecutionProvider")
+        tokenizer = AutoTokenizer.from_pretrained(Config.LOCAL_MODERATION_ONNX_DIR)
+    else:
+        from transformers import AutoModelForSequenceClassification
+        model = AutoModelForSequenceClassification.from_pretrained(Config.LOCAL_MODERATION_MODEL_NAME)
+        tokenizer = AutoTokenizer.from_pretrained(Config.LOCAL_MODERATION_MODEL_NAME)
+        if Config.LOCAL_MODERATION_QUANTIZE:
+            import torch
+            # Dynamic quantization of the Linear layers, which dominate BERT-style inference on CPU
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    # The pipeline keeps this tokenizer, so it is loaded once per process along with the model
+    return pipeline(
+        "text-classification",
+        model=model,
+        tokenizer=tokenizer,
+        top_k=None,                  # Return a score for every label
+        function_to_apply="sigmoid"  # Labels are independent (multi-label), not a softmax
+    )
+
 class LLMService:
     """
     A service class to centralize the initialization and management of LLM instances.
     This promotes DRY (Don't Repeat Yourself) and makes it easier to swap or configure LLMs.
     """
-    _chat_llm_instance = None       # Stores the LLM instance for the main chatbot
-    _moderation_llm_instance = None # Stores the LLM instance for the moderation layer
+    _base_llm = None                # Stores the ChatOpenAI client (and its HTTP connection pool) shared by chat and moderation
+    _chat_llm_instance = None       # Stores the base LLM bound to the main chatbot's settings
+    _moderation_llm_instance = None # Stores the base LLM bound to the moderation layer's settings
+    _local_moderation_classifier = None       # Stores the local moderation classifier pipeline
+    _local_moderation_classifier_failed = False # Set once loading fails, so it isn't retried on every call
+    _lock = threading.Lock() # Guards first-time initialization; warm calls only check the instance attribute
+    # Loading the classifier can take minutes (download, ONNX export, quantization), so it has its own lock
+    # and never holds up sessions initializing the chat or moderation LLM
+    _classifier_lock = threading.Lock()
 
     @classmethod
-    def get_chat_llm(cls):
+    def _get_base_llm(cls) -> "ChatOpenAI | None":
         """
-        Returns the LLM instance configured for the main chatbot.
-        Initializes it if it doesn't exist to ensure singleton-like behavior.
+        Returns the ChatOpenAI instance shared by the chat and moderation LLMs.
+        Temperature is a per-request parameter, so both paths bind their own on top of one client.
+        Must be called with cls._lock held.
         """
-        if cls._chat_llm_instance is None:
+        if cls._base_llm is None:
             # Check if API key is provided before initializing LLM
             if not Config.OPENAI_API_KEY:
-                logger.error("OPENAI_API_KEY is not set for chat LLM. Cannot initialize.")
+                logger.error("OPENAI_API_KEY is not set. Cannot initialize LLM.")
                 # Return None or raise an exception if LLM cannot be initialized
                 return None
-            cls._chat_llm_instance = ChatOpenAI(
+            # Imported lazily; only needed once an LLM is actually built
+            from langchain_openai import ChatOpenAI
+            from services.response_cache import LLMResponseCache
+            cls._base_llm = ChatOpenAI(
                 openai_api_key=Config.OPENAI_API_KEY,
                 model_name=Config.LLM_MODEL_NAME,
-                temperature=Config.LLM_TEMPERATURE_CHATBOT # Use specific temperature for chat
+                http_client=_HTTP_CLIENT,
+                http_async_client=_ASYNC_HTTP_CLIENT,
+                # Replies are only reusable when chat generation is deterministic; the bound temperature
+                # is part of the cache key, so chat and moderation entries never mix
+                cache=LLMResponseCache(Config.CHAT_CACHE_MAX_ENTRIES, Config.CHAT_CACHE_TTL_SECONDS)
+                      if Config.LLM_TEMPERATURE_CHATBOT == 0 else None
             )
-            logger.info(f"Initialized Chat LLM: {Config.LLM_MODEL_NAME} with temperature {Config.LLM_TEMPERATURE_CHATBOT}")
+            logger.info(f"Initialized LLM client: {Config.LLM_MODEL_NAME}")
+        return cls._base_llm
+
+    @classmethod
+    def get_chat_llm(cls):
+        """
+        Returns the LLM instance configured for the main chatbot.
+        Initializes it if it doesn't exist to ensure singleton-like behavior.
+        """
+        if cls._chat_llm_instance is None:
+            with cls._lock:
+                if cls._chat_llm_instance is None:
+                    base_llm = cls._get_base_llm()
+                    if base_llm is None:
+                        return None
+                    # Use specific temperature for chat
+                    cls._chat_llm_instance = base_llm.bind(temperature=Config.LLM_TEMPERATURE_CHATBOT)
+                    logger.info(f"Initialized Chat LLM: {Config.LLM_MODEL_NAME} with temperature {Config.LLM_TEMPERATURE_CHATBOT}")
         return cls._chat_llm_instance
 
     @classmethod
@@ -39,15 +132,33 @@ class LLMService:
         Initializes it if it doesn't exist.
         """
         if cls._moderation_llm_instance is None:
-            # Check if API key is provided
-            if not Config.OPENAI_API_KEY:
-                logger.error("OPENAI_API_KEY is not set for moderation LLM. Cannot initialize.")
-                return None
-            cls._moderation_llm_instance = ChatOpenAI(
-                openai_api_key=Config.OPENAI_API_KEY,
-                model_name=Config.LLM_MODEL_NAME,
-                temperature=Config.LLM_TEMPERATURE_MODERATION # Use specific temperature for moderation
-            )
-            logger.info(f"Initialized Moderation LLM: {Config.LLM_MODEL_NAME} with temperature {Config.LLM_TEMPERATURE_MODERATION}")
+            with cls._lock:
+                if cls._moderation_llm_instance is None:
+                    base_llm = cls._get_base_llm()
+                    if base_llm is None:
+                        return None
+                    # Use specific temperature for moderation, and cap the reply at a verdict plus a short reason
+                    cls._moderation_llm_instance = base_llm.bind(temperature=Config.LLM_TEMPERATURE_MODERATION,
+                                                                 max_tokens=Config.MODERATION_MAX_TOKENS)
+                    logger.info(f"Initialized Moderation LLM: {Config.LLM_MODEL_NAME} with temperature {Config.LLM_TEMPERATURE_MODERATION}")
         return cls._moderation_llm_instance
 
+    @classmethod
+    def get_local_moderation_classifier(cls):
+        """
+        Returns the local moderation classifier (a Hugging Face text-classification pipeline).
+        Initializes it on first use. Returns None if `transformers` is not installed or the model
+        cannot be loaded, in which case callers fall back to LLM-based moderation.
+        """
+        if cls._local_moderation_classifier is None and not cls._local_moderation_classifier_failed:
+            with cls._classifier_lock:
+                if cls._local_moderation_classifier is None and not cls._local_moderation_classifier_failed:
+                    try:
+                        cls._local_moderation_classifier = _load_local_moderation_classifier()
+                        logger.info(f"Initialized local moderation classifier: {Config.LOCAL_MODERATION_MODEL_NAME}"
+                                    f"{' (ONNX Runtime)' if Config.LOCAL_MODERATION_USE_ONNX else ''}"
+                                    f"{' (INT8)' if Config.LOCAL_MODERATION_QUANTIZE else ''}")
+                    except Exception as e:
+                        logger.error(f"Local moderation classifier could not be initialized; falling back to LLM moderation: {e}")
+                        cls._local_moderation_classifier_failed = True
+        return cls._local_moderation_classifier
@@ -1,38 +1,189 @@
-import streamlit as st
+import atexit
+import json
 import logging
-from langchain.memory import ConversationBufferMemory
-from langchain_core.chat_history import BaseChatMessageHistory # For type hinting
+import os
+import queue
+import re
+import threading
+import time
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, HumanMessage, message_to_dict, messages_from_dict
+from config import Config # Import Config to access memory window settings
+from moderation.pii import redact # Lightweight; doesn't pull in the moderation chain
 
 logger = logging.getLogger(__name__)
 
+class SinkWindowHistory(BaseChatMessageHistory):
+    """
+    Chat message history bounded to the first `sink_size` messages plus the most recent `window_size`.
+    Messages in between are dropped as new ones arrive, so a long conversation keeps its opening
+    context and its latest turns while using a fixed amount of memory.
+    """
+    def __init__(self, sink_size: int = Config.MEMORY_SINK_MESSAGES, window_size: int = Config.MEMORY_WINDOW_MESSAGES):
+        self.sink_size = sink_size
+        self.window_size = window_size
+        self.messages: list[BaseMessage] = []
+
+    def add_messages(self, messages: list[BaseMessage]) -> None:
+        """Appends the messages, then drops the oldest ones outside the sink once the window is full."""
+        self.messages.extend(messages)
+        overflow = len(self.messages) - self.sink_size - self.window_size
+        if overflow > 0:
+            del self.messages[self.sink_size:self.sink_size + overflow]
+
+    def clear(self) -> None:
+        self.messages = []
+
+# Session IDs become file names, so only plain identifiers (e.g. UUIDs) are accepted
+_SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
+class _SessionFileWriter:
+    """
+    Appends chat history records to per-session JSONL files from a background thread.
+    Callers only enqueue records, so a turn never waits on disk I/O; queued records are written
+    every Config.SESSION_FLUSH_INTERVAL_SECONDS and once more when the process exits.
+    Files untouched for Config.SESSION_HISTORY_RETENTION_DAYS are deleted at startup and then hourly.
+    """
+    PRUNE_INTERVAL_SECONDS = 60 * 60
+    _instance = None                 # Stores the process-wide writer shared by all sessions
+    _instance_lock = threading.Lock() # Guards creation of the shared writer
+
+    def __init__(self):
+        self._queue = queue.Queue() # (path, JSON line), or (path, None) to truncate the file
+        self._flush_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="session-history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the process-wide writer, starting it on first use."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def append(self, path: str, record: dict) -> None:
+        self._queue.put((path, json.dumps(record)))
+
+    def truncate(self, path: str) -> None:
+        self._queue.put((path, None))
+
+    def _run(self):
+        last_prune = 0.0
+        while True:
+            if time.monotonic() - last_prune >= self.PRUNE_INTERVAL_SECONDS:
+                self.prune_expired()
+                last_prune = time.monotonic()
+            time.sleep(Config.SESSION_FLUSH_INTERVAL_SECONDS)
+            self.flush()
+
+    def prune_expired(self) -> None:
+        """Deletes session history files not written to within Config.SESSION_HISTORY_RETENTION_DAYS."""
+        cutoff = time.time() - Config.SESSION_HISTORY_RETENTION_DAYS * 24 * 60 * 60
+        with self._flush_lock: # Not while a flush may be appending to one of the files
+            try:
+                entries = list(os.scandir(Config.SESSION_HISTORY_DIR))
+            except FileNotFoundError:
+                return
+            expired = 0
+            for entry in entries:
+                try:
+                    if entry.name.endswith(".jsonl") and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        expired += 1
+                except OSError as e:
+                    logger.error(f"Error deleting expired chat history {entry.path}: {e}")
+        if expired:
+            logger.info(f"Deleted {expired} chat history files older than {Config.SESSION_HISTORY_RETENTION_DAYS} days.")
+
+    def flush(self) -> None:
+        """Writes every queued record, opening each session's file once per flush."""
+        with self._flush_lock:
+            pending = {} # path -> (truncate first, lines to append), in queue order
+            while True:
+                try:
+                    path, line = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if line is None:
+                    pending[path] = (True, [])
+                else:
+                    pending.setdefault(path, (False, []))[1].append(line)
+            for path, (truncate, lines) in pending.items():
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, "w" if truncate else "a", encoding="utf-8") as f:
+                        f.writelines(line + "\n" for line in lines)
+                except OSError as e:
+                    logger.error(f"Error writing chat history to {path}: {e}")
+
+class PersistentChatHistory(SinkWindowHistory):
+    """
+    SinkWindowHistory that also records every message to `Config.SESSION_HISTORY_DIR/{session_id}.jsonl`.
+    Memory is updated first and the file write is queued (write-behind), so only the bounded window
+    is held in RAM while the full conversation survives restarts and can be resumed by session ID.
+    User messages are written with PII redacted (inputs blocked for containing PII are still recorded).
+    """
+    def __init__(self, session_id: str, sink_size: int = Config.MEMORY_SINK_MESSAGES,
+                 window_size: int = Config.MEMORY_WINDOW_MESSAGES):
+        if not _SESSION_ID_PATTERN.fullmatch(session_id):
+            raise ValueError(f"Invalid session ID for persistent chat history: {session_id!r}")
+        super().__init__(sink_size, window_size)
+        self.path = os.path.join(Config.SESSION_HISTORY_DIR, f"{session_id}.jsonl")
+        self._writer = _SessionFileWriter.get_instance()
+        self._load()
+
+    def _load(self) -> None:
+        """Restores the sink and window from a previously recorded conversation, if any."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                records = [json.loads(line) for line in f if line.strip()]
+            super().add_messages(messages_from_dict(records))
+            logger.info(f"Restored {len(records)} chat history records from {self.path}")
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Error restoring chat history from {self.path}: {e}")
+
+    def add_messages(self, messages: list[BaseMessage]) -> None:
+        super().add_messages(messages)
+        for message in messages:
+            if isinstance(message, HumanMessage):
+                message = message.copy(update={"content": redact(message.content)})
+            self._writer.append(self.path, message_to_dict(message))
+
+    def clear(self) -> None:
+        super().clear()
+        self._writer.truncate(self.path)
+
 class MemoryManager:
     """
-    Manages LangChain's ConversationBufferMemory instances, storing them
+    Manages per-session conversation histories, storing them
     within Streamlit's session_state for persistence across app reruns.
-    Each Streamlit session (i.e., browser tab) gets its own unique conversation memory.
+    Each Streamlit session (i.e., browser tab) gets its own unique conversation memory,
+    which Streamlit releases together with the rest of the session's state.
     """
     @staticmethod
     def get_session_history(session_id: str) -> BaseChatMessageHistory:
         """
-        Retrieves or creates a ConversationBufferMemory instance for a given session ID.
-        This function is designed to be passed to LangChain's RunnableWithMessageHistory.
-        It stores the memory objects within Streamlit's session_state.
+        Retrieves or creates the chat history for a given session ID
+        (a PersistentChatHistory when Config.PERSIST_CHAT_HISTORY is enabled, else a SinkWindowHistory).
+        It stores the history objects within Streamlit's session_state.
         """
-        # Initialize the 'langchain_memory_store' dictionary within Streamlit's session_state
-        # if it doesn't already exist for the current Streamlit session.
-        if "langchain_memory_store" not in st.session_state:
-            st.session_state.langchain_memory_store = {}
-            logger.info("Initialized Streamlit's session_state.langchain_memory_store.")
-
-        # If a ConversationBufferMemory instance for the current session_id doesn't exist
-        # in our session-state-managed store, create a new one.
-        if session_id not in st.session_state.langchain_memory_store:
-            logger.info(f"Creating new ConversationBufferMemory for session ID: {session_id}")
-            st.session_state.langchain_memory_store[session_id] = ConversationBufferMemory(
-                return_messages=True, # Important: memory returns actual message objects (HumanMessage, AIMessage)
-                memory_key="history" # This key should match the 'variable_name' in MessagesPlaceholder in your prompt
-            )
-        # Return the underlying ChatMessageHistory object from the ConversationBufferMemory instance.
-        # This object directly holds the list of chat messages.
-        return st.session_state.langchain_memory_store[session_id].chat_memory
-
+        # Each history is stored directly under its own session_state key (as StreamlitChatMessageHistory does),
+        # so it is visible in Streamlit's state inspection without an intermediate store dict
+        import streamlit as st # Imported lazily; only needed when running inside the Streamlit app
+        state_key = f"langchain_messages_{session_id}"
+        history = st.session_state.get(state_key)
+        if history is None:
+            # The history objects directly hold the list of chat messages
+            if Config.PERSIST_CHAT_HISTORY:
+                logger.info(f"Creating new PersistentChatHistory for session ID: {session_id}")
+                history = PersistentChatHistory(session_id)
+            else:
+                logger.info(f"Creating new SinkWindowHistory for session ID: {session_id}")
+                history = SinkWindowHistory()
+            st.session_state[state_key] = history
+        return history
@@ -0,0 +1,104 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from config import Config # Import Config to access batching settings
+
+logger = logging.getLogger(__name__)
+
+class ModerationBatcher:
+    """
+    Coalesces moderation LLM calls from concurrent Streamlit sessions into batched requests.
+    Each Streamlit session runs in its own thread; instead of every thread issuing its own blocking
+    round-trip, callers enqueue their prompt on a shared event loop which drains the queue every
+    few milliseconds (or as soon as a full batch accumulates) and dispatches a single `abatch` call.
+    """
+    _instance = None                 # Stores the process-wide batcher shared by all sessions
+    _instance_lock = threading.Lock() # Guards creation of the shared batcher
+
+    def __init__(self, runnable, max_batch_size: int = Config.MODERATION_BATCH_MAX_SIZE,
+                 max_wait_ms: int = Config.MODERATION_BATCH_MAX_WAIT_MS):
+        self.runnable = runnable
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        # Dedicated event loop running in a daemon thread, so synchronous callers can share batches
+        self._loop = asyncio.new_event_loop()
+        self._queue = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="moderation-batcher", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        logger.info(f"Started moderation batcher (max batch size {max_batch_size}, max wait {max_wait_ms}ms)")
+
+    @classmethod
+    def get_instance(cls, runnable):
+        """
+        Returns the process-wide batcher, creating it around the given runnable on first use.
+        Every moderator builds the same moderation chain, so later callers simply share the first one.
+        """
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    if runnable is None:
+                        raise ValueError("Moderation LLM is not initialized; cannot start the moderation batcher.")
+                    cls._instance = cls(runnable)
+        return cls._instance
+
+    def submit(self, item) -> concurrent.futures.Future:
+        """
+        Queues a single input for batched execution without blocking.
+        Items submitted together (e.g. by one caller moderating several texts) land in the same batch.
+        """
+        return asyncio.run_coroutine_threadsafe(self._submit(item), self._loop)
+
+    def invoke(self, item):
+        """
+        Submits a single input for batched execution and blocks until its result is available.
+        Exceptions raised for this item by the underlying runnable are re-raised to the caller.
+        """
+        return self.submit(item).result()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._worker())
+
+    async def _submit(self, item):
+        future = self._loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _worker(self):
+        """Collects queued items into batches bounded by size and wait time, then dispatches them."""
+        self._queue = asyncio.Queue()
+        self._ready.set()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without awaiting so the next batch can be collected while this one is in flight
+            self._loop.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        """Runs one `abatch` call for the collected items and resolves each caller's future by index."""
+        inputs = [item for item, _ in batch]
+        try:
+            results = await self.runnable.abatch(inputs, return_exceptions=True)
+        except Exception as e:
+            logger.error(f"Error during batched moderation of {len(batch)} item(s): {e}")
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,68 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from langchain_core.caches import BaseCache
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache for LLM results, shared by all Streamlit sessions in the process.
+    Keys are fixed-size digests of the prompt text, so long prompts don't bloat the cache.
+    Entries expire after `ttl_seconds` (if set), so cached results are eventually refreshed.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: float | None = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # key -> (stored_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(text: str) -> bytes:
+        """Returns a 16-byte digest of the text for use as a cache key."""
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, key: bytes):
+        """Returns the cached value for the key, or None on a miss or if the entry has expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: bytes, value) -> None:
+        """Stores a value, evicting the least recently used entry once the cache is full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Removes all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class LLMResponseCache(BaseCache):
+    """
+    LangChain cache backed by a ResponseCache, passed to a chat model's `cache` argument.
+    Identical prompts get the stored reply, so it is only used for deterministic (temperature 0) models.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: float | None = None):
+        self._cache = ResponseCache(max_entries, ttl_seconds)
+
+    def lookup(self, prompt: str, llm_string: str):
+        return self._cache.get(ResponseCache.make_key(f"{llm_string}\x00{prompt}"))
+
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        self._cache.put(ResponseCache.make_key(f"{llm_string}\x00{prompt}"), return_val)
+
+    def clear(self, **kwargs) -> None:
+        self._cache.clear()
@@ -0,0 +1,12 @@
+import pytest
+from config import Config
+
+# Setup for testing: fixture to set a dummy API key for tests.
+# This prevents actual API calls during unit tests, making them faster and more reliable.
+@pytest.fixture(autouse=True)
+def set_env_for_tests(monkeypatch):
+    """
+    Sets a dummy API key for testing purposes; monkeypatch restores it afterwards.
+    Config reads OPENAI_API_KEY at import, so the attribute is patched rather than the environment variable.
+    """
+    monkeypatch.setattr(Config, "OPENAI_API_KEY", "sk-test-dummykey")
@@ -0,0 +1,84 @@
+import json
+import pytest
+import streamlit as st
+from langchain_core.messages import AIMessage, HumanMessage
+
+from config import Config
+from services.memory_manager import MemoryManager, PersistentChatHistory, SinkWindowHistory, _SessionFileWriter
+
+def make_turns(count: int) -> list:
+    """Builds `count` (user, AI) message pairs numbered from 0."""
+    return [message for i in range(count)
+            for message in (HumanMessage(content=f"question {i}"), AIMessage(content=f"answer {i}"))]
+
+def test_sink_window_history_keeps_sink_and_latest_messages():
+    """Tests that trimming keeps the first sink_size messages plus the latest window_size, in order."""
+    history = SinkWindowHistory(sink_size=2, window_size=4)
+    for message_pair in zip(*[iter(make_turns(5))] * 2):
+        history.add_messages(list(message_pair))
+    assert [message.content for message in history.messages] == [
+        "question 0", "answer 0", "question 3", "answer 3", "question 4", "answer 4"]
+
+def test_sink_window_history_trims_large_appends():
+    """Tests that a single append larger than the window is trimmed down in one go."""
+    history = SinkWindowHistory(sink_size=2, window_size=2)
+    history.add_messages(make_turns(4))
+    assert [message.content for message in history.messages] == ["question 0", "answer 0", "question 3", "answer 3"]
+    history.clear()
+    assert history.messages == []
+
+def test_session_history_follows_session_state(monkeypatch):
+    """Tests that reruns get the session's stored history, and that a reset session_state gets a new one."""
+    monkeypatch.setattr(Config, "PERSIST_CHAT_HISTORY", False)
+    monkeypatch.setattr(st, "session_state", {})
+    history = MemoryManager.get_session_history("session-a")
+    assert MemoryManager.get_session_history("session-a") is history
+    assert MemoryManager.get_session_history("session-b") is not history
+
+    monkeypatch.setattr(st, "session_state", {}) # Session state reset (or a new Streamlit session)
+    assert MemoryManager.get_session_history("session-a") is not history
+
+@pytest.fixture
+def history_dir(tmp_path, monkeypatch):
+    """Points persistent chat histories at a temporary directory."""
+    monkeypatch.setattr(Config, "SESSION_HISTORY_DIR", str(tmp_path))
+    return tmp_path
+
+def test_persistent_history_reloads_window_and_truncates(history_dir):
+    """Tests that a recorded conversation is restored into the sink and window, and that clear() empties the file."""
+    history = PersistentChatHistory("session-1", sink_size=2, window_size=2)
+    history.add_messages(make_turns(3))
+    _SessionFileWriter.get_instance().flush()
+    assert len((history_dir / "session-1.jsonl").read_text().splitlines()) == 6 # Full conversation on disk
+
+    restored = PersistentChatHistory("session-1", sink_size=2, window_size=2)
+    assert [message.content for message in restored.messages] == ["question 0", "answer 0", "question 2", "answer 2"]
+
+    restored.clear()
+    _SessionFileWriter.get_instance().flush()
+    assert (history_dir / "session-1.jsonl").read_text() == ""
+    assert PersistentChatHistory("session-1").messages == []
+
+def test_persistent_history_redacts_pii_on_disk(history_dir):
+    """Tests that PII in user messages is redacted in the file but kept in the in-memory window."""
+    history = PersistentChatHistory("session-2")
+    history.add_messages([HumanMessage(content="My SSN is 123-45-6789"), AIMessage(content="Blocked.")])
+    _SessionFileWriter.get_instance().flush()
+    assert "123-45-6789" not in (history_dir / "session-2.jsonl").read_text()
+    assert history.messages[0].content == "My SSN is 123-45-6789"
+
+def test_persistent_history_rejects_unsafe_session_ids(history_dir):
+    """Tests that session IDs which could escape the history directory are refused."""
+    with pytest.raises(ValueError):
+        PersistentChatHistory("../outside")
+
+def test_session_file_writer_applies_queued_writes_in_order(history_dir):
+    """Tests that one flush applies appends and truncations in the order they were queued."""
+    writer = _SessionFileWriter.get_instance()
+    path = history_dir / "ordered.jsonl"
+    writer.append(str(path), {"n": 1})
+    writer.truncate(str(path))
+    writer.append(str(path), {"n": 2})
+    writer.append(str(path), {"n": 3})
+    writer.flush()
+    assert [json.loads(line)["n"] for line in path.read_text().splitlines()] == [2, 3]
@@ -0,0 +1,68 @@
+import threading
+import pytest
+
+from services.moderation_batcher import ModerationBatcher
+
+class RecordingRunnable:
+    """Stands in for the moderation chain: upper-cases each input and records every batch it receives."""
+    def __init__(self, fail_on=(), fail_batch=False):
+        self.fail_on = set(fail_on)
+        self.fail_batch = fail_batch
+        self.batches = []
+
+    async def abatch(self, inputs, return_exceptions=False):
+        self.batches.append(list(inputs))
+        if self.fail_batch:
+            raise RuntimeError("batch failed")
+        return [ValueError(item) if item in self.fail_on else item.upper() for item in inputs]
+
+def test_full_batch_is_dispatched_without_waiting():
+    """Tests that a batch is dispatched as soon as it reaches max_batch_size, well before max_wait_ms."""
+    runnable = RecordingRunnable()
+    batcher = ModerationBatcher(runnable, max_batch_size=3, max_wait_ms=60_000)
+    futures = [batcher.submit(item) for item in ("a", "b", "c")]
+    assert [future.result(timeout=5) for future in futures] == ["A", "B", "C"]
+    assert runnable.batches == [["a", "b", "c"]]
+
+def test_partial_batch_is_dispatched_after_max_wait():
+    """Tests that queued items are dispatched together once max_wait_ms passes without a full batch."""
+    runnable = RecordingRunnable()
+    batcher = ModerationBatcher(runnable, max_batch_size=100, max_wait_ms=50)
+    futures = [batcher.submit(item) for item in ("a", "b")]
+    assert [future.result(timeout=5) for future in futures] == ["A", "B"]
+    assert runnable.batches == [["a", "b"]]
+
+def test_errors_reach_the_right_future():
+    """Tests that an item's exception is raised only for that item, and a failed batch fails all of its items."""
+    batcher = ModerationBatcher(RecordingRunnable(fail_on={"b"}), max_batch_size=3, max_wait_ms=60_000)
+    futures = [batcher.submit(item) for item in ("a", "b", "c")]
+    assert futures[0].result(timeout=5) == "A"
+    with pytest.raises(ValueError):
+        futures[1].result(timeout=5)
+    assert futures[2].result(timeout=5) == "C"
+
+    batcher = ModerationBatcher(RecordingRunnable(fail_batch=True), max_batch_size=2, max_wait_ms=60_000)
+    futures = [batcher.submit(item) for item in ("a", "b")]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+
+def test_invoke_from_several_threads():
+    """Tests that concurrent callers each get their own result and every item is dispatched exactly once."""
+    runnable = RecordingRunnable()
+    batcher = ModerationBatcher(runnable, max_batch_size=4, max_wait_ms=20)
+    items = [f"item {i}" for i in range(16)]
+    results = {}
+
+    def call(item):
+        results[item] = batcher.invoke(item)
+
+    threads = [threading.Thread(target=call, args=(item,)) for item in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert results == {item: item.upper() for item in items}
+    assert sorted(item for batch in runnable.batches for item in batch) == sorted(items)
+    assert all(len(batch) <= 4 for batch in runnable.batches)